@@ -0,0 +1,12 @@
+# gunicorn settings for running the app outside of the flask debug server
+# run with: gunicorn user:app
+#
+# threaded workers let many requests wait on spotify at the same time. every worker has its own
+# requests session, cache and thread pool from user.py which its threads share
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", 4))
+worker_class = "gthread"
+threads = int(os.getenv("THREADS", 16))
+timeout = 30
@@ -0,0 +1,253 @@
+import os
+import socket
+import sys
+import tempfile
+import threading
+
+import pytest
+from urllib3.exceptions import MaxRetryError
+from urllib3.response import HTTPResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# keep the session files of the tests out of the repo
+os.environ['SESSION_DIR'] = tempfile.mkdtemp()
+
+import user
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200, headers=None):
+        self.data = data
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = str(data)
+
+    def json(self):
+        return self.data
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def logged_in_client():
+    client = user.app.test_client()
+    with client.session_transaction() as session:
+        session['access_token'] = 'token'
+        session['refresh_token'] = 'refresh'
+        session['expires_at'] = 9999999999
+    return client
+
+
+def test_endpoint_urls():
+    assert user.TOP_ARTISTS_URL == 'https://api.spotify.com/v1/me/top/artists'
+    assert user.TOP_TRACKS_URL == 'https://api.spotify.com/v1/me/top/tracks'
+    assert user.PLAYLISTS_URL == 'https://api.spotify.com/v1/me/playlists'
+    assert user.RECOMMENDATIONS_URL == 'https://api.spotify.com/v1/recommendations'
+    assert user.SEARCH_URL == 'https://api.spotify.com/v1/search'
+
+
+def test_index_page():
+    response = user.app.test_client().get('/')
+    assert response.status_code == 200
+
+
+def test_login_redirects_to_spotify():
+    response = user.app.test_client().get('/login')
+    assert response.status_code == 302
+    assert response.headers['Location'] == user.LOGIN_URL
+
+
+def test_pages_need_login():
+    client = user.app.test_client()
+    for page in ['/artists', '/tracks', '/playlists', '/dashboard', '/suggestions']:
+        response = client.get(page)
+        assert response.status_code == 302
+        assert response.headers['Location'].endswith('/login')
+
+
+def test_autocomplete_keeps_best_match_for_a_name(monkeypatch):
+    user.CACHE.clear()
+    results = {'artists': {'items': [
+        {'name': 'Nirvana', 'id': 'best'},
+        {'name': 'Nirvana', 'id': 'other'},
+        {'name': 'Nirvana UK', 'id': 'uk'}
+    ]}}
+    monkeypatch.setattr(user, 'spotify_get', lambda url, **kwargs: FakeResponse(results))
+
+    response = logged_in_client().get('/autocomplete-artists?q=nirvana')
+
+    assert response.get_json() == [
+        {'name': 'Nirvana', 'id': 'best'},
+        {'name': 'Nirvana', 'id': 'other'},
+        {'name': 'Nirvana UK', 'id': 'uk'}
+    ]
+    assert user.cache_get('artist_id:nirvana') == 'best'
+    assert user.cache_get('artist_id:nirvana uk') == 'uk'
+
+
+def test_recommendations_with_artist_id_skip_the_search(monkeypatch):
+    user.CACHE.clear()
+    requested = []
+
+    def fake_get(url, **kwargs):
+        requested.append(url)
+        return FakeResponse({'tracks': [{'name': 'Song', 'artists': [{'name': 'Band'}], 'popularity': 50}]})
+
+    monkeypatch.setattr(user, 'spotify_get', fake_get)
+
+    response = logged_in_client().post('/get-recommendations', data={
+        'artist': 'Band', 'artist_id': 'abc', 'genre': 'rock', 'minimum': 0, 'maximum': 100
+    })
+
+    assert response.get_json() == [{'name': 'Song', 'artist': 'Band', 'popularity': 50}]
+    assert requested == [user.RECOMMENDATIONS_URL]
+
+
+def test_cache_drops_expired_and_oldest_entries(monkeypatch):
+    user.CACHE.clear()
+    monkeypatch.setattr(user, 'cache_next_purge', 0)
+    monkeypatch.setattr(user, 'CACHE_MAX_ENTRIES', 2)
+
+    user.cache_set('old', 1, -1) # already expired
+    monkeypatch.setattr(user, 'cache_next_purge', 0) # next write sweeps
+    user.cache_set('a', 1, 60)
+    assert 'old' not in user.CACHE
+
+    user.cache_set('b', 2, 60)
+    user.cache_set('c', 3, 60)
+    assert list(user.CACHE) == ['b', 'c']
+    assert user.cache_get('c') == 3
+
+
+def test_slow_refresh_does_not_block_other_users(monkeypatch):
+    user.CACHE.clear()
+    release_slow = threading.Event()
+
+    def fake_post(url, data, **kwargs):
+        if data['refresh_token'] == 'slow':
+            release_slow.wait(5)
+        return FakeResponse({'access_token': 'new-' + data['refresh_token'], 'expires_in': 3600})
+
+    monkeypatch.setattr(user.SESSION, 'post', fake_post)
+
+    slow = threading.Thread(target=user.refresh_access_token, args=('slow',))
+    slow.start()
+    try:
+        assert user.refresh_access_token('fast')[0] == 'new-fast'
+        assert release_slow.is_set() is False
+    finally:
+        release_slow.set()
+        slow.join()
+    assert user.REFRESH_LOCKS == {}
+
+
+def test_retry_gives_up_on_long_retry_after():
+    response = HTTPResponse(status=429, headers={'Retry-After': '30'})
+    with pytest.raises(MaxRetryError):
+        user.RETRY.increment('GET', '/v1/me/top/artists', response=response)
+
+
+def test_retry_waits_for_short_retry_after():
+    response = HTTPResponse(status=429, headers={'Retry-After': '1'})
+    retry = user.RETRY.increment('GET', '/v1/me/top/artists', response=response)
+    assert isinstance(retry, user.SpotifyRetry)
+    assert retry.get_retry_after(response) == 1
+
+
+def test_spotify_timeouts_redirect_instead_of_failing(monkeypatch):
+    user.CACHE.clear()
+
+    def timeout(url, **kwargs):
+        raise user.requests.exceptions.Timeout()
+
+    monkeypatch.setattr(user, 'spotify_get', timeout)
+    client = logged_in_client()
+    for page in ['/artists', '/tracks', '/playlists', '/dashboard', '/suggestions']:
+        response = client.get(page)
+        assert response.status_code == 302
+        assert response.headers['Location'].endswith('/login')
+    assert client.get('/autocomplete-artists?q=abba').status_code == 400
+
+
+def test_expired_entries_are_revalidated_with_etag(monkeypatch):
+    user.CACHE.clear()
+    clock = FakeClock()
+    monkeypatch.setattr(user, 'time', clock)
+    sent_headers = []
+    replies = [
+        FakeResponse({'items': [{'name': 'Mix', 'owner': {'display_name': 'me'}, 'description': ''}]}, headers={'ETag': '"v1"'}),
+        FakeResponse(None, status_code=304)
+    ]
+
+    def fake_get(url, headers, **kwargs):
+        sent_headers.append(headers)
+        return replies.pop(0)
+
+    monkeypatch.setattr(user, 'spotify_get', fake_get)
+    headers = {'Authorization': 'Bearer token'}
+
+    first = user.cached_spotify_data(user.PLAYLISTS_URL, headers, user.build_playlists)
+    assert user.cached_spotify_data(user.PLAYLISTS_URL, headers, user.build_playlists) == first
+    assert len(sent_headers) == 1 # the second call was answered from the cache
+
+    clock.now += user.CACHE_TTL + 1
+    assert user.cached_spotify_data(user.PLAYLISTS_URL, headers, user.build_playlists) == first
+    assert 'If-None-Match' not in sent_headers[0]
+    assert sent_headers[1]['If-None-Match'] == '"v1"'
+
+
+def test_artists_and_tracks_pages_are_reused(monkeypatch):
+    user.CACHE.clear()
+    requested = []
+    replies = {
+        user.TOP_ARTISTS_URL: {'items': [{'name': 'Band', 'images': [], 'popularity': 70, 'genres': ['rock']}]},
+        user.TOP_TRACKS_URL: {'items': [{'name': 'Song', 'duration_ms': 187000, 'popularity': 60, 'artists': [{'name': 'Band'}]}]}
+    }
+
+    def fake_get(url, **kwargs):
+        requested.append(url)
+        return FakeResponse(replies[url])
+
+    monkeypatch.setattr(user, 'spotify_get', fake_get)
+    monkeypatch.setattr(user, 'render_template', lambda template, **context: f"{template}:{len(requested)}")
+    client = logged_in_client()
+
+    for page, template in [('/artists', 'artists.html'), ('/tracks', 'tracks.html')]:
+        first = client.get(page).get_data(as_text=True)
+        user.CACHE.pop(f"Bearer token:{user.TOP_ARTISTS_URL}", None) # only the html should be reused
+        user.CACHE.pop(f"Bearer token:{user.TOP_TRACKS_URL}", None)
+        assert client.get(page).get_data(as_text=True) == first
+        assert first.startswith(template)
+    assert requested == [user.TOP_ARTISTS_URL, user.TOP_TRACKS_URL]
+
+
+def test_read_timeouts_are_not_retried():
+    # a server that accepts connections but never answers
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(10)
+    connections = []
+
+    def accept():
+        while True:
+            try:
+                connections.append(server.accept()[0])
+            except OSError:
+                return
+
+    threading.Thread(target=accept, daemon=True).start()
+    session = user.requests.Session()
+    session.mount('http://', user.HTTPAdapter(max_retries=user.RETRY))
+    try:
+        with pytest.raises(user.requests.exceptions.RequestException):
+            session.get(f"http://127.0.0.1:{server.getsockname()[1]}/", timeout=0.2)
+        assert len(connections) == 1
+    finally:
+        server.close()
+        for connection in connections:
+            connection.close()
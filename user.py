@@ -1,15 +1,42 @@
-from flask import Flask, redirect, request, jsonify, session, render_template, url_for
+from flask import Flask, redirect, request, jsonify, session, render_template, url_for, g
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+from collections import namedtuple
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import MaxRetryError, ResponseError
 import os
+import threading
+import hashlib
+import logging
+import time
 from dotenv import load_dotenv
+from flask_session import Session
+from cachelib.file import FileSystemCache
 import urllib.parse
-import json
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 app.secret_key = 'secret_key'
 
 load_dotenv()
+# only warnings and errors are logged unless LOG_LEVEL is set (for example LOG_LEVEL=DEBUG)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
+
+# keep the session (tokens) on the server so the cookie only holds a session id.
+# files work for a single machine, set SESSION_TYPE=redis and REDIS_URL to share sessions between machines
+app.config['SESSION_TYPE'] = os.getenv("SESSION_TYPE", "cachelib")
+if app.config['SESSION_TYPE'] == 'redis':
+    import redis
+    app.config['SESSION_REDIS'] = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379"))
+else:
+    # the session files hold users tokens, they are only readable by the user running the app
+    app.config['SESSION_CACHELIB'] = FileSystemCache(
+        os.getenv("SESSION_DIR", os.path.join(app.root_path, "flask_session")), threshold=10000, mode=0o600
+    )
+Session(app)
+
 # I put the client id and secret in a .env file. Therefore I use os.getenv to retrieve them
 CLIENT_ID = os.getenv("CLIENT_ID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
@@ -18,6 +45,183 @@ REDIRECT_URI = 'http://localhost:5000/callback'
 AUTH_URL = 'https://accounts.spotify.com/authorize'
 TOKEN_URL = 'https://accounts.spotify.com/api/token'
 API_BASE_URL = 'https://api.spotify.com/v1'
+# the spotify endpoints this app uses, built once instead of on every request
+TOP_ARTISTS_URL = API_BASE_URL + '/me/top/artists'
+TOP_TRACKS_URL = API_BASE_URL + '/me/top/tracks'
+PLAYLISTS_URL = API_BASE_URL + '/me/playlists'
+RECOMMENDATIONS_URL = API_BASE_URL + '/recommendations'
+SEARCH_URL = API_BASE_URL + '/search'
+
+# defining the scope that this app will need from the users spotify account
+SCOPE = 'user-read-private user-read-email user-top-read'
+# parameters that are needed to get authorization
+LOGIN_PARAMS = {
+    'client_id': CLIENT_ID, 
+    'response_type': 'code',  
+    'scope': SCOPE, 
+    'redirect_uri': REDIRECT_URI, 
+    'show_dialog': True # only for debugging
+}
+# the login url never changes so it is only built once
+LOGIN_URL = f"{AUTH_URL}?{urllib.parse.urlencode(LOGIN_PARAMS)}"
+
+# one shared session for every call to spotify so the TCP/TLS connection is kept alive
+# and reused between requests instead of doing a new handshake every time
+SESSION = requests.Session()
+# longest we will wait before retrying a request. retries happen while the request holds a
+# SPOTIFY_SEMAPHORE slot (and maybe a refresh lock), so long waits would stall other users
+MAX_RETRY_WAIT = 2
+
+
+class SpotifyRetry(Retry):
+    """Retry policy that gives up straight away when spotify asks us to wait longer than
+        MAX_RETRY_WAIT (Retry-After), returning the 429 to the route instead of sleeping"""
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None:
+            retry_after = self.get_retry_after(response)
+            if retry_after is not None and retry_after > MAX_RETRY_WAIT:
+                # with raise_on_status=False urllib3 hands the last response back to the caller
+                raise MaxRetryError(_pool, url, ResponseError(f"Retry-After of {retry_after}s is too long to wait"))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+# when spotify is rate limiting us (429) or has a server error, wait and try again instead of
+# failing the users request. a 429 tells us how long to wait in its Retry-After header
+RETRY = SpotifyRetry(
+    total=5,
+    # a read error means spotify may already have handled the request (a refresh token POST for example)
+    # and a read timeout has already waited SPOTIFY_TIMEOUT, so those are never retried
+    read=0,
+    backoff_factor=0.5,
+    backoff_max=MAX_RETRY_WAIT,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=['GET', 'POST'],
+    respect_retry_after_header=True,
+    raise_on_status=False # once out of retries hand back the last response so the routes can handle it
+)
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=RETRY
+))
+SESSION.headers.update({'Accept': 'application/json'})
+
+# thread pool used to send independent spotify requests at the same time
+EXECUTOR = ThreadPoolExecutor(max_workers=8)
+# caps how many requests this process has in flight to spotify at once so a burst of users
+# fanning out requests does not run into spotify's rate limit
+SPOTIFY_SEMAPHORE = threading.BoundedSemaphore(20)
+# seconds to wait for spotify to connect or send data before giving up, so a hung connection
+# can not hold on to a semaphore slot (or a worker thread) forever
+SPOTIFY_TIMEOUT = 10
+
+
+def spotify_get(url, **kwargs):
+    """This function is used to send a GET request to the spotify api through the shared session
+        Input: str (url), any keyword arguments that requests accepts (headers, params...)
+        Output: requests.Response"""
+    kwargs.setdefault('timeout', SPOTIFY_TIMEOUT)
+    with SPOTIFY_SEMAPHORE:
+        return SESSION.get(url, **kwargs)
+
+
+# small in-process cache for spotify data that changes slowly (top artists, top tracks, playlists, artist ids)
+# every entry is stored as key -> (time it expires at, value)
+CACHE = {}
+CACHE_LOCK = threading.Lock()
+CACHE_TTL = 60 # seconds that a users top artists/tracks/playlists are reused for
+ARTIST_ID_TTL = 7 * 24 * 60 * 60 # an artist's id basically never changes so keep it for a week
+ETAG_TTL = 60 * 60 # keep etags as long as an access token lasts so expired entries can be revalidated
+CACHE_MAX_ENTRIES = 10000 # when the cache is full the oldest entries are dropped
+CACHE_PURGE_INTERVAL = 60 # seconds between sweeps that remove expired entries nobody asked for again
+cache_next_purge = 0
+
+
+def cache_get(key):
+    """This function is used to look up a value in the cache
+        Input: str (cache key)
+        Output: the cached value, or None if it is missing or has expired"""
+    with CACHE_LOCK:
+        entry = CACHE.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() > expires_at:
+            del CACHE[key]
+            return None
+        return value
+
+
+def cache_set(key, value, ttl):
+    """This function is used to save a value in the cache for ttl seconds
+        Input: str (cache key), any (value), int (seconds to keep the value)
+        Output: None"""
+    global cache_next_purge
+    now = time.monotonic()
+    with CACHE_LOCK:
+        # keys hold access tokens which change every hour, so most entries are never read again
+        # after they expire. sweep them out every so often instead of waiting for a read
+        if now > cache_next_purge:
+            for expired_key in [k for k, (expires_at, _) in CACHE.items() if now > expires_at]:
+                del CACHE[expired_key]
+            cache_next_purge = now + CACHE_PURGE_INTERVAL
+
+        # re-inserting moves the key to the end, so the front of the dict is always the oldest write
+        CACHE.pop(key, None)
+        CACHE[key] = (now + ttl, value)
+        while len(CACHE) > CACHE_MAX_ENTRIES:
+            del CACHE[next(iter(CACHE))]
+
+
+def cached_spotify_data(url, headers, build, ttl=CACHE_TTL):
+    """This function is used to get the data of a spotify GET request, reusing the last
+        result for the same user and url if it is less than ttl seconds old.
+        Once it is older than that spotify is asked if it changed (If-None-Match) and a
+        304 Not Modified reply lets us keep using the data we already have.
+        Only the output of build is kept, not the whole json response, so the cache
+        holds just the few fields that the pages show
+        Input: str (url), dictionary (headers), function (turns the json response into the data we keep), int (seconds to cache for)
+        Output: whatever build returns, or None if the request failed"""
+    # the access token is part of the key so users never see each others data
+    key = f"{headers['Authorization']}:{url}"
+    data = cache_get(key)
+    if data is not None:
+        return data
+
+    etag_key = f"etag:{key}"
+    etag_entry = cache_get(etag_key) # (etag, data) from the last full response
+    if etag_entry is not None:
+        headers = {**headers, 'If-None-Match': etag_entry[0]}
+
+    try:
+        response = spotify_get(url, headers=headers)
+    except requests.exceptions.RequestException as e:
+        logger.warning("Error: %s", e)
+        return None
+    if response.status_code == 304 and etag_entry is not None:
+        data = etag_entry[1]
+    elif response.status_code == 200:
+        # the full json response is thrown away as soon as the fields we need are pulled out
+        data = build(response.json())
+        if 'ETag' in response.headers:
+            cache_set(etag_key, (response.headers['ETag'], data), ETAG_TTL)
+    else:
+        logger.warning("Error: %s - %s", response.status_code, response.text)
+        return None
+
+    cache_set(key, data, ttl)
+    return data
+
+
+@app.before_request
+def load_spotify_headers():
+    """This function runs before every request and builds the headers we send to the spotify api once,
+        so every call made while handling the request can reuse them"""
+    if 'access_token' in session:
+        g.spotify_headers = {
+            'Authorization': f"Bearer {session['access_token']}"
+        }
 
 
 @app.route('/')
@@ -26,21 +230,7 @@ def index():
 
 @app.route('/login')
 def login():
-    # defining the scope that this app will need from the users spotify account
-    scope = 'user-read-private user-read-email user-top-read'
-    
-    # parameters that are needed to get authorization
-    params = {
-        'client_id': CLIENT_ID, 
-        'response_type':'code',  
-        'scope': scope, 
-        'redirect_uri': REDIRECT_URI, 
-        'show_dialog': True # only for debugging
-    }
-    
-    auth_url = f"{AUTH_URL}?{urllib.parse.urlencode(params)}"
-    
-    return redirect(auth_url)
+    return redirect(LOGIN_URL)
 
 @app.route('/home')
 def home():
@@ -63,7 +253,13 @@ def callback():
             'client_secret': CLIENT_SECRET
         }
         
-        response = requests.post(TOKEN_URL, data=req_body)
+        # an authorization code can only be used once, so this request must not be retried.
+        # it is sent without the retrying session (it only happens once per login anyway)
+        try:
+            response = requests.post(TOKEN_URL, data=req_body, timeout=SPOTIFY_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error: %s", e)
+            return jsonify({"error": "Could not reach spotify to log in"}), 502
         token_info = response.json()
         # get the access token, refresh token, and time it expires (24 hours from now)
         session['access_token'] = token_info['access_token']
@@ -74,6 +270,57 @@ def callback():
     
     
     
+# lightweight records for the data we show, the templates read them the same way as dictionaries (artist.name...)
+Artist = namedtuple('Artist', 'name picture popularity genres')
+Track = namedtuple('Track', 'name time popularity artist')
+Playlist = namedtuple('Playlist', 'name creator description')
+
+
+def build_artists(response_data):
+    """This function is used to pull the data we show about each artist out of the /me/top/artists response
+        Input: dictionary (json response from spotify)
+        Output: list (one Artist per artist)"""
+    return [
+        Artist(
+            artist['name'],
+            artist['images'][0]['url'] if artist['images'] else None, # get first picture of artist
+            artist['popularity'],
+            artist['genres']
+        )
+        for artist in response_data['items']
+    ]
+
+def format_track_time(track_length):
+    """This function is used to turn the length of a track into the text shown on the tracks page
+        Input: int (length of the track in milliseconds)
+        Output: str (minutes::seconds)"""
+    # whole minutes and the seconds left over
+    minutes, seconds = divmod(track_length // 1000, 60)
+    return f"{minutes}::{seconds:02d}"
+
+def build_tracks(response_data):
+    """This function is used to pull the data we show about each track out of the /me/top/tracks response
+        Input: dictionary (json response from spotify)
+        Output: list (one Track per track)"""
+    return [
+        Track(
+            track['name'],
+            format_track_time(track['duration_ms']),
+            track['popularity'],
+            [x['name'] for x in track['artists']]
+        )
+        for track in response_data['items']
+    ]
+
+def build_playlists(response_data):
+    """This function is used to pull the data we show about each playlist out of the /me/playlists response
+        Input: dictionary (json response from spotify)
+        Output: list (one Playlist per playlist)"""
+    return [
+        Playlist(playlist['name'], playlist['owner']['display_name'], playlist['description'])
+        for playlist in response_data['items']
+    ]
+
 @app.route('/artists')
 def get_top_artists():
     """This function is used to run the artists.html page"""
@@ -83,35 +330,21 @@ def get_top_artists():
     # if the token has expired, guide the user to get another token
     if datetime.now().timestamp() > session['expires_at']:
         return redirect('/refresh-token')
-    # define the headers, we will have to use these for any request that we make to the spotify api
-    headers = {
-        'Authorization': f"Bearer {session['access_token']}"
-    }
-    
-    response = requests.get(API_BASE_URL + '/me/top/artists', headers=headers) # this is the page where we get users top artists
-    # status code of 200 means that the request was successful
-    if response.status_code == 200:
-        response_data = response.json()
-        artists = [] # we will keep all of our information about artists in this list
-        for artist in response_data['items']: #iterate through the items response
-            artist_name = artist['name']
-            artist_picture = artist['images'][0]['url'] if artist['images'] else None # get first picture of artist
-            popularity = artist['popularity']
-            genres = artist['genres']
-            # for every artist, keep a dictionary about all their data
-            artist_data = {
-                'name': artist_name,
-                'picture': artist_picture,
-                'popularity': popularity,
-                'genres': genres
-            }
-
-            artists.append(artist_data)
+    # if this page was rendered for this user a moment ago send the same html again
+    html_key = f"html:{g.spotify_headers['Authorization']}:artists"
+    html = cache_get(html_key)
+    if html is not None:
+        return html
+
+    artists = cached_spotify_data(TOP_ARTISTS_URL, g.spotify_headers, build_artists) # this is the page where we get users top artists
+    # None means that the request was not successful
+    if artists is not None:
         # the html page will now be passed the artists list which will be shown
-        return render_template('artists.html', artists=artists)
+        html = render_template('artists.html', artists=artists)
+        cache_set(html_key, html, CACHE_TTL)
+        return html
     
     else:
-        print(f"Error: {response.status_code} - {response.text}")
         return redirect('/login')
 
 
@@ -124,43 +357,18 @@ def get_top_tracks():
     if datetime.now().timestamp() > session['expires_at']:
         return redirect('/refresh-token')
     
-    headers = {
-        'Authorization': f"Bearer {session['access_token']}"
-    }
-    
-    response = requests.get(API_BASE_URL + '/me/top/tracks', headers=headers)
-    if response.status_code == 200:
-        response_data = response.json()
-        tracks = []
-        for track in response_data['items']:
-            track_name = track['name']
-            track_length = track['duration_ms']
-            total_seconds = track_length / 1000 # get the seconds
-            minutes = total_seconds // 60 # divide the amount of seconds down by 60 to get the minutes
-            seconds = total_seconds - (minutes * 60) #          
-            print(f'seconds: {seconds}')
-            popularity = track['popularity']
-            artists = track['artists']
-            print()
-            all = []
-            for x in artists:
-                name = x['name']
-                all.append(name)
-                
-
-            track_data = {
-                'name': track_name,
-                'time': f"{str(int(minutes))}::{str(round(seconds, 2))}",
-                'popularity': popularity,
-                'artist': all
-            }
-
-            tracks.append(track_data)
-        
-        return render_template('tracks.html', tracks=tracks)
+    html_key = f"html:{g.spotify_headers['Authorization']}:tracks"
+    html = cache_get(html_key)
+    if html is not None:
+        return html
+
+    tracks = cached_spotify_data(TOP_TRACKS_URL, g.spotify_headers, build_tracks)
+    if tracks is not None:
+        html = render_template('tracks.html', tracks=tracks)
+        cache_set(html_key, html, CACHE_TTL)
+        return html
     
     else:
-        print(f"Error: {response.status_code} - {response.text}")
         return redirect('/login')    
     
  
@@ -172,32 +380,32 @@ def get_playlists():
     if datetime.now().timestamp() > session['expires_at']:
         return redirect('/refresh-token')
     
-    headers = {
-        'Authorization': f"Bearer {session['access_token']}"
-    }
-    
-    response = requests.get(API_BASE_URL + '/me/playlists', headers=headers)
-    response_data = json.loads(response.text)
-    
-    playlists = []
-    for playlist in response_data['items']:
-        name = playlist['name']
-        creator = playlist['owner']['display_name']
-        description = playlist['description']
-        
-        playlists.append({'name': name, 'creator': creator, 'description': description})
+    playlists = cached_spotify_data(PLAYLISTS_URL, g.spotify_headers, build_playlists)
+    if playlists is None:
+        return redirect('/login')
 
     return render_template('playlists.html', playlists=playlists)
 
-def build_recommendations_url(params):
-    """This function is used to help build the url 
-        for the two pages that encoding the4 parameters that they use
-        Input: dictionary (parameters)
-        Output: str (url used to send requests)"""
-    base_url = f"{API_BASE_URL}/recommendations"
-    query_params = urllib.parse.urlencode(params)
-    url = f"{base_url}?{query_params}"
-    return url
+@app.route('/dashboard')
+def dashboard():
+    """This function runs the dashboard.html page which shows top artists, top tracks and playlists together.
+        The three requests do not depend on each other so they are sent at the same time"""
+    if 'access_token' not in session:
+        return redirect('/login')
+    
+    if datetime.now().timestamp() > session['expires_at']:
+        return redirect('/refresh-token')
+    
+    artists_future = EXECUTOR.submit(cached_spotify_data, TOP_ARTISTS_URL, g.spotify_headers, build_artists)
+    tracks_future = EXECUTOR.submit(cached_spotify_data, TOP_TRACKS_URL, g.spotify_headers, build_tracks)
+    playlists_future = EXECUTOR.submit(cached_spotify_data, PLAYLISTS_URL, g.spotify_headers, build_playlists)
+    wait([artists_future, tracks_future, playlists_future])
+    
+    artists, tracks, playlists = artists_future.result(), tracks_future.result(), playlists_future.result()
+    if artists is None or tracks is None or playlists is None:
+        return redirect('/login')
+    
+    return render_template('dashboard.html', artists=artists, tracks=tracks, playlists=playlists)
 
 @app.route('/suggestions', methods=['GET', 'POST'])
 def get_song_suggestions():
@@ -207,11 +415,6 @@ def get_song_suggestions():
     if datetime.now().timestamp() > session['expires_at']:
         return redirect('/refresh-token')
 
-    headers = {
-        'Authorization': f"Bearer {session['access_token']}",
-        #'Content-Type': 'application/json'
-    }
-
     # Set the parameter values manually
     seed_artists = "5ficpwpxT4Gz9OsA3h3fFA"
     seed_genres = "work-out"
@@ -225,9 +428,12 @@ def get_song_suggestions():
         "market": market
     }
     
-    #build the url 
-    url = build_recommendations_url(params)
-    response = requests.get(url, headers=headers)
+    # requests encodes the parameters onto the url for us
+    try:
+        response = spotify_get(RECOMMENDATIONS_URL, params=params, headers=g.spotify_headers)
+    except requests.exceptions.RequestException as e:
+        logger.warning("Error: %s", e)
+        return redirect('/login')
 
     if response.status_code == 200:
         response_data = response.json()
@@ -248,39 +454,89 @@ def get_song_suggestions():
             suggestions.append(sug_data)
         return render_template('suggestions.html', data=suggestions)
     else:
-        print(f"Error: {response.status_code} - {response.text}")
+        logger.warning("Error: %s - %s", response.status_code, response.text)
         return redirect('/login')
 
 def get_artist_id(artist_name):
     """This function is used to get the spotify id of an artist based on the artist name
         Input : str (name of artist)
         Output: str (spotify ID associated with artist)"""
+    # the id of an artist does not change so check if we have already looked this name up
+    cache_key = f"artist_id:{artist_name.lower()}"
+    artist_id = cache_get(cache_key)
+    if artist_id is not None:
+        return artist_id
+
     # Make a request to the Spotify API to search for the artist
-    headers = {
-        'Authorization': f"Bearer {session['access_token']}"
+    # passing the query as params lets requests url-encode names with spaces or & in them
+    params = {
+        'q': artist_name,
+        'type': 'artist',
+        'market': 'US',
+        'limit': 1,
+        'offset': 0
     }
-    search_url = f"{API_BASE_URL}/search?q={artist_name}&type=artist&market=US&limit=1&offset=0"
-    print(f'search url: {search_url}')
-    response = requests.get(search_url, headers=headers)
+    logger.debug('search params: %s', params)
+    try:
+        response = spotify_get(SEARCH_URL, params=params, headers=g.spotify_headers)
+    except requests.exceptions.RequestException as e:
+        logger.warning("Error: %s", e)
+        return None
 
     if response.status_code == 200:
         data = response.json()
         if data['artists']['items']: # if there is any results
             # Return the ID of the first artist in the search results
-            return data['artists']['items'][0]['id']
+            artist_id = data['artists']['items'][0]['id']
+            cache_set(cache_key, artist_id, ARTIST_ID_TTL)
+            return artist_id
 
     # If no artist is found or an error occurs, return None
-    print(f"no artists found")
+    logger.debug("no artists found for %s", artist_name)
     return None
 
+
+@app.route('/autocomplete-artists')
+def autocomplete_artists():
+    """This function is used by the custom recommendations form to suggest artists while the user types.
+        It returns the name and id of each match so the form can send the id and skip the search later"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify([])
+
+    params = {
+        'q': query,
+        'type': 'artist',
+        'market': 'US',
+        'limit': 5
+    }
+    try:
+        response = spotify_get(SEARCH_URL, params=params, headers=g.spotify_headers)
+    except requests.exceptions.RequestException as e:
+        logger.warning("Error: %s", e)
+        return jsonify({'error': 'An error occurred while searching for artists'}), 400
+    if response.status_code != 200:
+        logger.warning("Error: %s - %s", response.status_code, response.text)
+        return jsonify({'error': 'An error occurred while searching for artists'}), 400
+
+    artists = []
+    for artist in response.json()['artists']['items']:
+        # remember the ids we see so typing one of these names in full does not need another search.
+        # results come best match first, so a lower ranked artist with the same name never replaces it
+        cache_key = f"artist_id:{artist['name'].lower()}"
+        if cache_get(cache_key) is None:
+            cache_set(cache_key, artist['id'], ARTIST_ID_TTL)
+        artists.append({'name': artist['name'], 'id': artist['id']})
+    return jsonify(artists)
+
    
 @app.route('/custom-recommendations', methods=['POST', 'GET'])
 def get_custom_recommendations():
     """This function is used to get custom reccomendations 
     based on the input values filled in in the html page"""
-    headers = {
-        'Authorization': f"Bearer {session['access_token']}"
-    }
     if request.method == 'POST':
         # Get form data
         artist_name = request.form['artist']
@@ -288,12 +544,8 @@ def get_custom_recommendations():
         min_pop = request.form.get('minimum', 0, type=int)
         max_pop = request.form.get('maximum', 100, type=int)
         
-        #   print(f'artist:{artist_name}')
-        #   print(f'genre: {selected_genres}')
-    
-        # Get the Spotify ID for the artist name
-        artist_id = get_artist_id(artist_name)
-        #   print(artist_id)
+        # Get the Spotify ID for the artist name, the form already has it if the artist was picked from the suggestions
+        artist_id = request.form.get('artist_id') or get_artist_id(artist_name)
 
         if artist_id:
             # Build parameters for recommendation request
@@ -309,11 +561,14 @@ def get_custom_recommendations():
                 "min_popularity": min_pop,
                 "max_popularity": max_pop
             }
-            print(f'Reccomendations with params: {params}')
+            logger.debug('Reccomendations with params: %s', params)
 
             # Make recommendation request to Spotify API
-            url = build_recommendations_url(params)
-            response = requests.get(url, headers=headers)
+            try:
+                response = spotify_get(RECOMMENDATIONS_URL, params=params, headers=g.spotify_headers)
+            except requests.exceptions.RequestException as e:
+                logger.warning("Error: %s", e)
+                return jsonify({'error': 'An error occurred while fetching recommendations'}), 400
             
             # Response Code of 200 means that the request was successful
             if response.status_code == 200:
@@ -331,10 +586,9 @@ def get_custom_recommendations():
                         'popularity': popularity
                     }
                     suggestions.append(sug_data)
-                #print(suggestions)
                 return render_template('custom_recommendations.html', data=suggestions)
             else:
-                print(f"Error: {response.status_code} - {response.text}")
+                logger.warning("Error: %s - %s", response.status_code, response.text)
                 return jsonify({'error': 'An error occurred while fetching recommendations'}), 400
 
 
@@ -349,7 +603,7 @@ def get_recommendations():
             min_pop = request.form.get('minimum', 0, type=int)
             max_pop = request.form.get('maximum', 100, type=int)
 
-            artist_id = get_artist_id(artist_name)
+            artist_id = request.form.get('artist_id') or get_artist_id(artist_name)
 
             if artist_id:
                 seed_artists = artist_id
@@ -365,9 +619,11 @@ def get_recommendations():
                     "max_popularity": max_pop
                 }
 
-                url = build_recommendations_url(params)
-                headers = {'Authorization': f"Bearer {session['access_token']}"}
-                response = requests.get(url, headers=headers)
+                try:
+                    response = spotify_get(RECOMMENDATIONS_URL, params=params, headers=g.spotify_headers)
+                except requests.exceptions.RequestException as e:
+                    logger.warning("Error: %s", e)
+                    return jsonify({'error': 'An error occurred while fetching recommendations'}), 400
 
                 if response.status_code == 200:
                     response_data = response.json()
@@ -385,39 +641,104 @@ def get_recommendations():
 
                     return jsonify(suggestions)
                 else:
-                    print(f"Error: {response.status_code} - {response.text}")
+                    logger.warning("Error: %s - %s", response.status_code, response.text)
                     return jsonify({'error': 'An error occurred while fetching recommendations'}), 400
             else:
                 return jsonify({'error': 'No artist found'}), 404
         except Exception as e:
-            print(f"Error: {e}")
+            logger.exception("Error: %s", e)
             return jsonify({'error': 'An error occurred while processing the request'}), 500
 
     return jsonify({'error': 'Invalid request'}), 400
 
-@app.route('/refresh-token')
-def refresh_token():
-    """This function is used to get a refresh token if our session is over (old one has expired)"""
-    if 'refresh-token' not in session:
-        return render_template('home_of_app.html')
+# one lock per refresh token, so only one thread at a time refreshes the same user's token
+# while other users can refresh theirs. every entry is stored as token hash -> [lock, threads using it]
+REFRESH_LOCKS = {}
+
+
+def acquire_refresh_lock(token_hash):
+    """This function is used to wait for the refresh lock of one refresh token
+        Input: str (hash of the refresh token)
+        Output: threading.Lock (the lock, which is now held)"""
+    with CACHE_LOCK:
+        entry = REFRESH_LOCKS.setdefault(token_hash, [threading.Lock(), 0])
+        entry[1] += 1
+    entry[0].acquire()
+    return entry[0]
+
+
+def release_refresh_lock(token_hash, lock):
+    """This function is used to release a refresh lock and forget it once no thread is using it
+        Input: str (hash of the refresh token), threading.Lock (the lock that is held)
+        Output: None"""
+    lock.release()
+    with CACHE_LOCK:
+        entry = REFRESH_LOCKS[token_hash]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del REFRESH_LOCKS[token_hash]
+
+
+def refresh_access_token(refresh_token):
+    """This function is used to trade a refresh token for a new access token.
+        The new token is cached until shortly before it expires, so if several requests
+        find the old token expired at the same time only the first one asks spotify
+        Input: str (refresh token)
+        Output: tuple (access token, timestamp it expires at, new refresh token or None), or None if the request failed"""
+    token_hash = hashlib.sha256(refresh_token.encode()).hexdigest()
+    key = f"access:{token_hash}"
+    lock = acquire_refresh_lock(token_hash)
+    try:
+        # another request may have refreshed this token while we were waiting for the lock
+        token = cache_get(key)
+        if token is not None:
+            return token
 
-    if datetime.now().timestamp() > session['expires_at']:
         # set the parameters for what has to be sent to get another token
         req_body = {
-            'grant_type': 'refresh-token', 
-            'refresh_token': session['refresh_token'], 
+            'grant_type': 'refresh_token', 
+            'refresh_token': refresh_token, 
             'client_id': CLIENT_ID, 
             'client_secret': CLIENT_SECRET
         }
         # send this request with parameters and put the response in a json format
-        response = request.post(TOKEN_URL, data=req_body)
+        try:
+            response = SESSION.post(TOKEN_URL, data=req_body, timeout=SPOTIFY_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error: %s", e)
+            return None
+        if response.status_code != 200:
+            logger.warning("Error: %s - %s", response.status_code, response.text)
+            return None
         new_token_info = response.json()
+
+        expires_at = datetime.now().timestamp() + new_token_info['expires_in']
+        # spotify only sometimes sends back a new refresh token
+        token = (new_token_info['access_token'], expires_at, new_token_info.get('refresh_token'))
+        cache_set(key, token, new_token_info['expires_in'] - 60)
+        return token
+    finally:
+        release_refresh_lock(token_hash, lock)
+
+@app.route('/refresh-token')
+def refresh_token():
+    """This function is used to get a refresh token if our session is over (old one has expired)"""
+    if 'refresh_token' not in session:
+        return render_template('home_of_app.html')
+
+    if datetime.now().timestamp() > session['expires_at']:
+        token = refresh_access_token(session['refresh_token'])
+        if token is None:
+            return redirect('/login')
         
         # save the new token and the date it expires at in the session
-        session['access_token'] = new_token_info['access_token']
-        session['expires_at'] =  datetime.now().timestamp() + new_token_info['expires_in']
-        
-        return redirect('/home')
+        access_token, expires_at, new_refresh_token = token
+        session['access_token'] = access_token
+        session['expires_at'] = expires_at
+        if new_refresh_token:
+            session['refresh_token'] = new_refresh_token
+    
+    return redirect('/home')
     
     
     